@@ -1,21 +1,34 @@
 import os
 import csv
 import datetime
+import functools
 import logging
+import logging.handlers
+import mmap
+import queue
+import re
 import shutil
-import hashlib
+import sys
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import blake3
+import win32api
 import win32file
 import pywintypes
 import win32con
 
-def set_file_creation_time(file_path, creation_time):
+def update_file_times(file_path, creation_time, modification_time):
     """
-    pip install pywin32
-    creation_time: 时间戳（秒）
+    更新文件的创建时间和修改时间（访问时间与修改时间相同）
+    只打开一次文件句柄，通过一次 SetFileTime 同时设置三个时间
+    creation_time: 原始创建时间（时间戳，秒）
+    modification_time: 导入时间（时间戳，秒）
     """
     try:
-        win_time = pywintypes.Time(creation_time)
+        win_creation_time = pywintypes.Time(creation_time)
+        win_modification_time = pywintypes.Time(modification_time)
         handle = win32file.CreateFile(
             file_path,
             win32con.GENERIC_WRITE,
@@ -25,64 +38,300 @@ def set_file_creation_time(file_path, creation_time):
             0,
             None
         )
-        win32file.SetFileTime(handle, win_time, None, None)
-        handle.close()
-        return True
+        try:
+            win32file.SetFileTime(handle, win_creation_time, win_modification_time, win_modification_time)
+        finally:
+            handle.close()
+        logging.debug(f"更新时间成功: {file_path}")
     except Exception as e:
-        logging.error(f"设置创建时间失败 {file_path}: {e}")
-        return False
+        logging.error(f"更新文件时间失败 {file_path}: {e}")
 
-def update_file_times(file_path, creation_time, modification_time):
+def compute_file_hash(file_path):
     """
-    更新文件的创建时间和修改时间
-    creation_time: 原始创建时间（时间戳，秒）
-    modification_time: 导入时间（时间戳，秒）
+    计算文件的 BLAKE3 哈希值（pip install blake3）
+    文件通过 mmap 读取并由多线程 SIMD 计算，仅用于判断文件内容是否相同
     """
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
     try:
-        os.utime(file_path, (modification_time, modification_time))
-        set_file_creation_time(file_path, creation_time)
-        logging.debug(f"更新时间成功: {file_path}")
+        hasher.update_mmap(file_path)
     except Exception as e:
-        logging.error(f"更新文件时间失败 {file_path}: {e}")
+        logging.error(f"计算哈希出错 {file_path}: {e}")
+        raise
+    return hasher.hexdigest()
 
-def compute_md5(file_path, chunk_size=8192):
+class FileHashCache:
+    """
+    基于 SQLite 的文件哈希缓存，以 (路径, 文件 ID, 文件大小, 修改时间) 判断缓存是否有效，
+    重复运行时可跳过对未改动文件的完整读取。
+    文件 ID（st_ino，NTFS 文件索引号）用于识别同一路径上被替换的新文件：
+    修改时间只精确到分钟，仅凭大小和修改时间无法区分。
     """
-    计算文件的 MD5 值
+    def __init__(self, db_path, commit_interval=500):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_digest ("
+            "path TEXT PRIMARY KEY, file_id TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._commit_interval = commit_interval
+        self._pending = 0
+
+    def get(self, file_path):
+        """
+        返回文件的哈希值：缓存命中时直接返回，否则计算后写入缓存
+        """
+        st = os.stat(file_path)
+        key = os.path.normcase(os.path.abspath(file_path))
+        # ReFS 的文件 ID 为 128 位，超出 SQLite INTEGER 范围，因此以文本保存
+        file_id = str(st.st_ino)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, size, mtime_ns, digest FROM file_digest WHERE path = ?", (key,)
+            ).fetchone()
+        if row is not None and row[0] == file_id and row[1] == st.st_size and row[2] == st.st_mtime_ns:
+            return row[3]
+
+        digest = compute_file_hash(file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_digest (path, file_id, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+                (key, file_id, st.st_size, st.st_mtime_ns, digest)
+            )
+            self._pending += 1
+            if self._pending >= self._commit_interval:
+                self._conn.commit()
+                self._pending = 0
+        return digest
+
+    def close(self):
+        """
+        提交尚未写入的缓存记录并关闭数据库
+        """
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+# 文件哈希缓存，在 main() 中初始化；为 None 时不使用缓存
+hash_cache = None
+
+def get_file_hash(file_path):
+    """
+    获取文件的哈希值，已初始化缓存时优先从缓存读取
+    """
+    if hash_cache is None:
+        return compute_file_hash(file_path)
+    return hash_cache.get(file_path)
+
+# 计算哈希对时使用的共享线程池，避免每次比较都创建和销毁线程
+hash_executor = ThreadPoolExecutor(max_workers=8)
+
+def compute_hash_pair(file_a, file_b):
+    """
+    并发计算两个文件的哈希值，返回 (hash_a, hash_b)
+    file_a 交给共享线程池计算，file_b 在当前线程中计算，磁盘 I/O 可以相互重叠
+    """
+    future_a = hash_executor.submit(get_file_hash, file_a)
+    hash_b = get_file_hash(file_b)
+    return future_a.result(), hash_b
+
+def read_file_prefix(file_path, prefix_size=65536):
+    """
+    读取文件开头的 prefix_size 字节（默认 64 KiB），用于快速排除内容不同的文件
     """
-    md5 = hashlib.md5()
     try:
         with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                md5.update(chunk)
+            return f.read(prefix_size)
     except Exception as e:
-        logging.error(f"计算 MD5 出错 {file_path}: {e}")
+        logging.error(f"读取文件开头出错 {file_path}: {e}")
         raise
-    return md5.hexdigest()
 
-def generate_new_filename(dest_dir, file_name):
+def is_same_content(file_a, file_b):
+    """
+    判断两个大小相同的文件内容是否一致：
+    先比较文件开头部分，不同则直接判定为不同；相同时再比较完整的哈希值
+    """
+    if read_file_prefix(file_a) != read_file_prefix(file_b):
+        return False
+    hash_a, hash_b = compute_hash_pair(file_a, file_b)
+    return hash_a == hash_b
+
+def stat_or_none(file_path):
+    """
+    返回文件的 os.stat 结果，文件不存在或无法访问时返回 None（与 os.path.exists 一致，
+    包括非法文件名、权限不足等情况）。
+    用一次系统调用同时完成存在性检查与大小查询。
+    """
+    try:
+        return os.stat(file_path)
+    except (OSError, ValueError):
+        return None
+
+def map_file_readonly(file_path, max_size=64 * 1024 * 1024):
+    """
+    以只读方式将文件映射到内存，复制到多个相册时复用，避免重复读取源文件。
+    文件为空、超过 max_size（默认 64 MiB）或映射失败时返回 None。
+    """
+    try:
+        size = os.path.getsize(file_path)
+        if size == 0 or size > max_size:
+            return None
+        with open(file_path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception as e:
+        logging.warning(f"映射文件失败 {file_path}，将逐个复制: {e}")
+        return None
+
+def write_file_from_buffer(src_file, dest_file, src_data):
+    """
+    将已读入内存的源文件内容 src_data 写入 dest_file，并复制源文件的修改时间与属性。
+    目标文件已存在时抛出异常，不会覆盖；写入失败时删除不完整的目标文件。
+    """
+    fd = os.open(dest_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0))
+    try:
+        with memoryview(src_data) as view:
+            offset = 0
+            while offset < len(view):
+                offset += os.write(fd, view[offset:])
+    except Exception:
+        os.close(fd)
+        os.remove(dest_file)
+        raise
+    os.close(fd)
+    shutil.copystat(src_file, dest_file)
+
+# CopyFileEx 标志：目标已存在时失败 / 不经过系统缓存（大文件由系统以大块异步 I/O 传输）
+COPY_FILE_FAIL_IF_EXISTS = 0x00000001
+COPY_FILE_NO_BUFFERING = 0x00001000
+# 超过该大小（256 MiB）的文件使用无缓冲复制，避免大视频挤占系统缓存
+UNBUFFERED_COPY_THRESHOLD = 256 * 1024 * 1024
+
+def copy_file(src_file, dest_file, src_data=None, src_size=None):
+    """
+    复制文件，目标文件已存在时抛出异常，不会覆盖。
+    若提供 src_data（源文件内容的内存映射），则直接写入目标文件；
+    否则使用 Windows 原生 CopyFileEx 复制，由系统内核完成数据传输，
+    并保留修改时间与文件属性（与 shutil.copy2 行为一致）。
+    src_size 为源文件大小（可选），用于判断是否使用无缓冲复制，未提供时自动查询。
+    """
+    if src_data is not None:
+        write_file_from_buffer(src_file, dest_file, src_data)
+        return
+    if src_size is None:
+        src_size = os.path.getsize(src_file)
+    flags = COPY_FILE_FAIL_IF_EXISTS
+    if src_size > UNBUFFERED_COPY_THRESHOLD:
+        flags |= COPY_FILE_NO_BUFFERING
+    win32file.CopyFileEx(src_file, dest_file, None, None, False, flags)
+
+# 创建硬链接时目标已存在的错误码，此时不回退为复制，直接抛出
+ERROR_FILE_EXISTS = 80
+ERROR_ALREADY_EXISTS = 183
+# 表示整个卷无法创建硬链接的错误码（例如报告为 NTFS 的 SMB 共享）
+ERROR_INVALID_FUNCTION = 1
+ERROR_NOT_SAME_DEVICE = 17
+ERROR_NOT_SUPPORTED = 50
+VOLUME_HARD_LINK_ERRORS = (ERROR_INVALID_FUNCTION, ERROR_NOT_SAME_DEVICE, ERROR_NOT_SUPPORTED)
+
+# 因上述错误无法创建硬链接的卷，之后直接复制
+hard_link_failed_volumes = set()
+
+@functools.lru_cache(maxsize=None)
+def get_volume_info(folder):
+    """
+    返回 folder 所在卷的 (卷路径, 是否为 NTFS)，结果按文件夹缓存；获取失败时返回 (None, False)
+    """
+    try:
+        volume_path = win32file.GetVolumePathName(folder)
+        file_system = win32api.GetVolumeInformation(volume_path)[4]
+    except Exception as e:
+        logging.warning(f"获取卷信息失败 {folder}，将使用复制: {e}")
+        return None, False
+    return volume_path, file_system.upper() == "NTFS"
+
+def supports_hard_links(folder):
+    """
+    判断 folder 所在的卷是否可以创建硬链接：卷为 NTFS，且此前未在该卷上创建失败
+    """
+    volume_path, is_ntfs = get_volume_info(folder)
+    return is_ntfs and volume_path not in hard_link_failed_volumes
+
+def link_or_copy_file(src_file, dest_file, src_data=None, src_size=None):
+    """
+    将 src_file 放置到 dest_file：目标所在卷支持硬链接时创建硬链接，不复制任何数据；
+    创建硬链接失败（目标已存在除外）时回退为 copy_file。目标文件已存在时抛出异常。
+    只有卷级错误才会停用该卷的硬链接，单个文件的错误（如被占用、权限不足）只对该文件回退为复制。
+    """
+    folder = os.path.dirname(dest_file)
+    if supports_hard_links(folder):
+        try:
+            win32file.CreateHardLink(dest_file, src_file, None)
+            return
+        except pywintypes.error as e:
+            if e.winerror in (ERROR_FILE_EXISTS, ERROR_ALREADY_EXISTS):
+                raise
+            if e.winerror in VOLUME_HARD_LINK_ERRORS:
+                volume_path = get_volume_info(folder)[0]
+                hard_link_failed_volumes.add(volume_path)
+                logging.warning(f"卷 {volume_path} 无法创建硬链接，之后改为复制: {e}")
+            else:
+                logging.debug(f"无法创建硬链接 {dest_file}，改为复制: {e}")
+    copy_file(src_file, dest_file, src_data, src_size)
+
+def generate_new_filename(dest_dir, file_name, target_index=None):
     """
     根据目标目录中已存在的同名文件生成新的文件名（只允许重命名一次，即生成 {basename}_1{ext}）
     如果目标中已存在 {basename}_1{ext}，则返回 None 表示冲突（需要人工检查）
+    若提供 target_index（见 build_target_index），则直接查询索引而不访问文件系统
     """
     base, ext = os.path.splitext(file_name)
     new_name = f"{base}_1{ext}"
-    if os.path.exists(os.path.join(dest_dir, new_name)):
+    if target_index is not None:
+        exists = new_name.lower() in target_index
+    else:
+        exists = os.path.exists(os.path.join(dest_dir, new_name))
+    if exists:
         return None
     return new_name
 
+def build_target_index(target_root):
+    """
+    一次性枚举目标根目录，返回字典：键为小写文件名（NTFS 不区分大小写），值为文件大小。
+    阶段1通过该索引判断同名文件是否存在，无需对每个文件单独查询文件系统。
+    """
+    with os.scandir(target_root) as entries:
+        return {e.name.lower(): e.stat().st_size for e in entries if e.is_file()}
+
+# 日期格式示例: "Wednesday October 16,2024 4:32 AM GMT"
+# 小时与分钟的取值范围与 strptime 的 %I、%M 一致，超出范围的交给 strptime 报错
+DATE_PATTERN = re.compile(r"\w+ (\w+) (\d{1,2}),(\d{4}) (1[0-2]|0?[1-9]):([0-5]?\d) (AM|PM) GMT", re.IGNORECASE)
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+}
+
+@functools.lru_cache(maxsize=65536)
 def parse_date(date_str):
     """
     解析 CSV 中的日期字符串，返回时间戳（秒）
     日期格式示例: "Wednesday October 16,2024 4:32 AM GMT"
+    同一日期字符串（连拍、批量导入）只解析一次，结果会被缓存
     """
     if not date_str:
         return None
     date_str = date_str.strip().strip('"')
     try:
-        dt = datetime.datetime.strptime(date_str, "%A %B %d,%Y %I:%M %p GMT")
+        match = DATE_PATTERN.fullmatch(date_str)
+        if match is None or match.group(1).lower() not in MONTHS:
+            # 非常规格式交给 strptime 处理（或报告错误）
+            dt = datetime.datetime.strptime(date_str, "%A %B %d,%Y %I:%M %p GMT")
+            return dt.timestamp()
+        month, day, year, hour, minute, am_pm = match.groups()
+        hour = int(hour) % 12
+        if am_pm.upper() == "PM":
+            hour += 12
+        dt = datetime.datetime(int(year), MONTHS[month.lower()], int(day), hour, int(minute))
         return dt.timestamp()
     except Exception as e:
         logging.error(f"解析日期失败 {date_str}: {e}")
@@ -90,73 +339,104 @@ def parse_date(date_str):
 
 def load_photo_details(details_csv_path):
     """
-    加载 Photo Details.csv，返回字典：键为图片文件名，值为记录字典
+    加载 Photo Details.csv，返回字典：键为图片文件名，
+    值为 (原始创建时间, 导入时间) 时间戳元组，无法解析的日期为 None
     """
     photo_details = {}
     try:
         with open(details_csv_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                logging.warning(f"{details_csv_path} 为空，跳过")
+                return photo_details
+            missing = [c for c in ("imgName", "originalCreationDate", "importDate") if c not in header]
+            if missing:
+                logging.warning(f"{details_csv_path} 缺少列 {', '.join(missing)}，跳过")
+                return photo_details
+            idx_name = header.index("imgName")
+            idx_orig = header.index("originalCreationDate")
+            idx_import = header.index("importDate")
+            min_len = max(idx_name, idx_orig, idx_import) + 1
             for row in reader:
-                img_name = row.get("imgName", "").strip()
+                if len(row) < min_len:
+                    continue
+                img_name = row[idx_name].strip()
                 if img_name:
-                    photo_details[img_name] = row
+                    photo_details[img_name] = (parse_date(row[idx_orig]), parse_date(row[idx_import]))
     except Exception as e:
         logging.error(f"读取 {details_csv_path} 失败: {e}")
     return photo_details
 
-def copy_file_with_md5(src_file, dest_dir):
+# 匹配文件主干名末尾的 "_1"（可重复出现），用于将重命名前后的文件归为同一组
+RENAMED_SUFFIX_PATTERN = re.compile(r"(?:_1)+$")
+
+def file_group_key(file_name):
+    """
+    返回文件所属的文件名组：小写主干名去掉末尾的 "_1" 后缀。
+    同一照片的主图、Live Photo (.MOV) 及重命名文件 {basename}_1{ext} 属于同一组，
+    命名与删除只会在组内相互影响，不同组可以由不同线程并行处理。
+    """
+    stem = os.path.splitext(file_name)[0].lower()
+    return RENAMED_SUFFIX_PATTERN.sub("", stem)
+
+def copy_file_with_hash(src_file, dest_dir, target_index, src_size=None):
     """
     将 src_file 从源目录复制到 dest_dir。如果目标中已有同名文件，则：
-      - 如果文件大小相同且 MD5 相同，则直接返回目标文件路径；
+      - 如果文件大小相同且哈希值相同，则直接返回目标文件路径；
       - 如果文件内容不同，则尝试生成新的文件名（仅允许重命名一次，生成文件名末尾带 "_1"），
         如果该重命名文件已存在，则跳过并记录警告，返回 None。
     成功时返回目标中的文件路径，否则返回 None。
     注意：此处为复制操作，不删除源文件。
+    target_index 为 dest_dir 的文件索引（见 build_target_index），复制成功后同步更新。
+    src_size 为源文件大小（可选），调用方已知时传入可省去一次查询。
     """
     file_name = os.path.basename(src_file)
     dest_file = os.path.join(dest_dir, file_name)
-
-    if os.path.exists(dest_file):
+    if src_size is None:
         try:
             src_size = os.path.getsize(src_file)
-            dest_size = os.path.getsize(dest_file)
         except Exception as e:
-            logging.error(f"获取文件大小失败: {src_file} 或 {dest_file}: {e}")
+            logging.error(f"获取文件大小失败: {src_file}: {e}")
             return None
 
+    dest_size = target_index.get(file_name.lower())
+    if dest_size is not None:
+
         if src_size == dest_size:
             try:
-                src_md5 = compute_md5(src_file)
-                dest_md5 = compute_md5(dest_file)
+                same_content = is_same_content(src_file, dest_file)
             except Exception as e:
-                logging.error(f"计算 MD5 出错 {src_file} 或 {dest_file}: {e}")
+                logging.error(f"计算哈希出错 {src_file} 或 {dest_file}: {e}")
                 return None
 
-            if src_md5 == dest_md5:
-                logging.info(f"文件已存在且内容相同: {dest_file}")
+            if same_content:
+                logging.debug(f"文件已存在且内容相同: {dest_file}")
                 return dest_file
             else:
-                new_name = generate_new_filename(dest_dir, file_name)
+                new_name = generate_new_filename(dest_dir, file_name, target_index)
                 if new_name is None:
                     logging.warning(
                         f"重命名冲突：目标目录中已有 {file_name} 与 {os.path.splitext(file_name)[0]}_1{os.path.splitext(file_name)[1]}，跳过 {src_file}")
                     return None
                 new_dest_file = os.path.join(dest_dir, new_name)
                 try:
-                    shutil.copy2(src_file, new_dest_file)
+                    copy_file(src_file, new_dest_file, src_size=src_size)
+                    target_index[new_name.lower()] = src_size
                     logging.info(f"文件内容不同，将 {src_file} 复制并重命名为 {new_dest_file}")
                     return new_dest_file
                 except Exception as e:
                     logging.error(f"复制文件失败 {src_file} 到 {new_dest_file}: {e}")
                     return None
         else:
-            new_name = generate_new_filename(dest_dir, file_name)
+            new_name = generate_new_filename(dest_dir, file_name, target_index)
             if new_name is None:
                 logging.warning(f"大小不同但重命名冲突，跳过 {src_file}")
                 return None
             new_dest_file = os.path.join(dest_dir, new_name)
             try:
-                shutil.copy2(src_file, new_dest_file)
+                copy_file(src_file, new_dest_file, src_size=src_size)
+                target_index[new_name.lower()] = src_size
                 logging.info(f"大小不同，将 {src_file} 复制并重命名为 {new_dest_file}")
                 return new_dest_file
             except Exception as e:
@@ -164,7 +444,8 @@ def copy_file_with_md5(src_file, dest_dir):
                 return None
     else:
         try:
-            shutil.copy2(src_file, dest_file)
+            copy_file(src_file, dest_file, src_size=src_size)
+            target_index[file_name.lower()] = src_size
             # 验证目标文件是否存在
             if os.path.exists(dest_file):
                 logging.debug(f"目标文件 {dest_file} 校验成功！")
@@ -175,17 +456,19 @@ def copy_file_with_md5(src_file, dest_dir):
             logging.error(f"复制失败: {src_file} -> {dest_file}: {e}")
             return None
 
-def process_part_phase1(part_number, source_root, target_root, total_parts):
+def scan_part_phase1(part_number, source_root, total_parts):
     """
-    阶段1：处理单个部分，将 Photos 目录中的照片（更新时间后）从源文件夹复制到目标根目录，
+    阶段1：扫描单个部分的 Photos 目录，根据 Photo Details.csv 更新照片时间，
+    返回待复制文件列表 [(src_file, file_name, file_size), ...]（保持目录枚举顺序）。
     源文件夹名称格式为：
         "iCloud 照片 第 {part_number} 部分（共 {total_parts} 部分）"
     """
+    logging.info(f"处理第 {part_number} 部分")
     part_folder = os.path.join(source_root, f"iCloud 照片 第 {part_number} 部分（共 {total_parts} 部分）")
     photos_dir = os.path.join(part_folder, "Photos")
     if not os.path.exists(photos_dir):
         logging.warning(f"未找到 Photos 文件夹: {photos_dir}")
-        return
+        return []
 
     details_csv_path = os.path.join(photos_dir, "Photo Details.csv")
     photo_details = {}
@@ -194,32 +477,42 @@ def process_part_phase1(part_number, source_root, target_root, total_parts):
     else:
         logging.info(f"未找到 Photo Details.csv: {details_csv_path}")
 
-    for entry in os.listdir(photos_dir):
-        src_file = os.path.join(photos_dir, entry)
-        # 跳过 CSV 文件和子目录
-        if os.path.isdir(src_file) or entry.lower().endswith(".csv"):
-            continue
-        if not os.path.isfile(src_file):
+    files = []
+    with os.scandir(photos_dir) as entries:
+        dir_entries = list(entries)
+    for dir_entry in dir_entries:
+        entry = dir_entry.name
+        src_file = dir_entry.path
+        # 跳过 CSV 文件和子目录（文件类型由目录枚举结果直接给出，无需额外查询）
+        if entry.lower().endswith(".csv") or not dir_entry.is_file():
             continue
 
         # 若在 Photo Details 中有记录，则更新文件时间
-        details = photo_details.get(entry)
-        if details:
-            orig_date_str = details.get("originalCreationDate", "")
-            import_date_str = details.get("importDate", "")
-            creation_time = parse_date(orig_date_str)
-            import_time = parse_date(import_date_str)
-            if creation_time and import_time:
-                update_file_times(src_file, creation_time, import_time)
-
-        copied_path = copy_file_with_md5(src_file, target_root)
+        creation_time, import_time = photo_details.get(entry, (None, None))
+        if creation_time and import_time:
+            update_file_times(src_file, creation_time, import_time)
+
+        files.append((src_file, entry, dir_entry.stat().st_size))
+    return files
+
+def copy_file_group_phase1(files, target_root, target_index):
+    """
+    阶段1：按顺序将同一文件名组（见 file_group_key）的文件复制到目标根目录。
+    files 为 [(src_file, file_size), ...]，按部分编号排序，
+    因此组内的命名结果（谁保留原名、谁重命名为 "_1"）与逐个部分串行处理时一致，
+    同一部分的主图与 Live Photo 也总是得到相同的后缀。
+    target_index 为目标根目录的文件索引（见 build_target_index），各组共用
+    """
+    for src_file, src_size in files:
+        copied_path = copy_file_with_hash(src_file, target_root, target_index, src_size)
         if copied_path is None:
             logging.warning(f"文件复制失败或跳过: {src_file}")
 
 def build_global_album_mapping(source_root, total_parts):
     """
     遍历所有部分的 Albums 文件夹，读取各个 CSV 文件，
-    返回字典：键为照片名（例如 "IMG_8372.JPG"），值为所属相册名称的集合。
+    返回字典：键为照片名（例如 "IMG_8372.JPG"），值为所属相册名称的 frozenset，
+    所属相册完全相同的照片共用同一个 frozenset 对象。
     使用的部分文件夹名称格式为：
         "iCloud 照片 第 {part} 部分（共 {total_parts} 部分）"
     """
@@ -227,30 +520,44 @@ def build_global_album_mapping(source_root, total_parts):
     for part in range(1, total_parts + 1):
         part_folder = os.path.join(source_root, f"iCloud 照片 第 {part} 部分（共 {total_parts} 部分）")
         albums_dir = os.path.join(part_folder, "Albums")
-        if not os.path.exists(albums_dir) or not os.path.isdir(albums_dir):
+        if not os.path.isdir(albums_dir):
             continue
-        for file in os.listdir(albums_dir):
-            if not file.lower().endswith(".csv"):
-                continue
-            album_name = os.path.splitext(file)[0]
-            album_csv_path = os.path.join(albums_dir, file)
+        with os.scandir(albums_dir) as entries:
+            album_entries = [e for e in entries if e.name.lower().endswith(".csv") and e.is_file()]
+        for dir_entry in album_entries:
+            album_name = sys.intern(os.path.splitext(dir_entry.name)[0])
+            album_csv_path = dir_entry.path
             try:
+                # 相册 CSV 只有一列图片名，一次性读入后按行拆分（跳过表头），并在文件内去重；
+                # 使用 dict 去重以保持 CSV 中的顺序，阶段2按此顺序处理照片
                 with open(album_csv_path, 'r', encoding='utf-8-sig') as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None)  # 跳过表头（如果存在）
-                    for row in reader:
-                        if not row:
-                            continue
-                        image_name = row[0].strip().strip('"')
-                        if image_name:
-                            albums_mapping.setdefault(image_name, set()).add(album_name)
+                    lines = f.read().splitlines()
+                image_names = dict.fromkeys(line.strip().strip('"') for line in lines[1:])
+                image_names.pop("", None)
             except Exception as e:
                 logging.error(f"读取相册文件 {album_csv_path} 失败: {e}")
+                continue
+            for image_name in image_names:
+                album_set = albums_mapping.get(image_name)
+                if album_set is None:
+                    albums_mapping[image_name] = {album_name}
+                else:
+                    album_set.add(album_name)
+
+    # 相同的相册组合只保留一个 frozenset 实例
+    unique_album_sets = {}
+    for image_name, album_set in albums_mapping.items():
+        frozen = frozenset(album_set)
+        albums_mapping[image_name] = unique_album_sets.setdefault(frozen, frozen)
     return albums_mapping
 
-def copy_file_to_album(src_file, album_folder):
+def copy_file_to_album(src_file, album_folder, src_data=None, src_stat=None, trust_mtime=False):
     """
-    将 src_file 从目标根目录复制到 album_folder。
+    将 src_file 从目标根目录复制到 album_folder（同一 NTFS 卷上使用硬链接）。
+    src_data 为源文件内容的内存映射（可选），提供时直接写入，无需再次读取源文件。
+    src_stat 为源文件的 os.stat 结果（可选），提供时无需再次查询源文件大小。
+    若相册中的文件已是源文件的硬链接（同一文件），则直接视为内容相同。
+    trust_mtime 为 True 时，大小、修改时间与文件开头均相同的文件视为内容相同，不再计算完整哈希。
     复制时若目标中已有同名文件，则：
       - 如果内容相同，则认为已存在，不再复制；
       - 如果内容不同，则尝试以重命名方式（末尾加 "_1"）复制，但只允许一次重命名，
@@ -260,48 +567,52 @@ def copy_file_to_album(src_file, album_folder):
     file_name = os.path.basename(src_file)
     base, ext = os.path.splitext(file_name)
     candidate_renamed = f"{base}_1{ext}"
-    if os.path.exists(os.path.join(album_folder, candidate_renamed)):
+    # album_folder 由 process_album_image 生成，末尾不带路径分隔符，可直接拼接
+    renamed_dest = f"{album_folder}{os.sep}{candidate_renamed}"
+    if stat_or_none(renamed_dest) is not None:
         logging.warning(f"在相册 {album_folder} 中已存在重命名文件 {candidate_renamed}，跳过复制 {src_file}")
         return False
 
-    dest_file = os.path.join(album_folder, file_name)
-    if os.path.exists(dest_file):
-        try:
-            src_size = os.path.getsize(src_file)
-            dest_size = os.path.getsize(dest_file)
-        except Exception as e:
-            logging.error(f"获取文件大小失败 {src_file} 或 {dest_file}: {e}")
-            return False
+    dest_file = f"{album_folder}{os.sep}{file_name}"
+    try:
+        dest_stat = stat_or_none(dest_file)
+        if dest_stat is not None and src_stat is None:
+            src_stat = os.stat(src_file)
+    except Exception as e:
+        logging.error(f"获取文件大小失败 {src_file} 或 {dest_file}: {e}")
+        return False
+    src_size = src_stat.st_size if src_stat is not None else None
+
+    if dest_stat is not None:
+        dest_size = dest_stat.st_size
 
         if src_size == dest_size:
             try:
-                src_md5 = compute_md5(src_file)
-                dest_md5 = compute_md5(dest_file)
+                if os.path.samestat(src_stat, dest_stat):
+                    same_content = True
+                elif trust_mtime and src_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+                    # 修改时间只精确到分钟（来自 importDate），同批导入的不同照片也会相同，
+                    # 因此仍比较文件开头，避免误判后删除根目录中的原文件
+                    same_content = read_file_prefix(src_file) == read_file_prefix(dest_file)
+                else:
+                    same_content = is_same_content(src_file, dest_file)
             except Exception as e:
-                logging.error(f"计算 MD5 失败 {src_file} 或 {dest_file}: {e}")
+                logging.error(f"计算哈希失败 {src_file} 或 {dest_file}: {e}")
                 return False
-            if src_md5 == dest_md5:
-                logging.info(f"相册中已存在相同文件: {dest_file}")
+            if same_content:
+                logging.debug(f"相册中已存在相同文件: {dest_file}")
                 return True
             else:
-                renamed_dest = os.path.join(album_folder, candidate_renamed)
-                if os.path.exists(renamed_dest):
-                    logging.warning(f"在相册 {album_folder} 中重命名文件 {candidate_renamed} 已存在，跳过 {src_file}")
-                    return False
                 try:
-                    shutil.copy2(src_file, renamed_dest)
+                    link_or_copy_file(src_file, renamed_dest, src_data, src_size)
                     logging.info(f"文件 {src_file} 以重命名形式复制到 {renamed_dest} (内容不同)")
                     return True
                 except Exception as e:
                     logging.error(f"复制 {src_file} 到 {renamed_dest} 失败: {e}")
                     return False
         else:
-            renamed_dest = os.path.join(album_folder, candidate_renamed)
-            if os.path.exists(renamed_dest):
-                logging.warning(f"在相册 {album_folder} 中重命名文件 {candidate_renamed} 已存在（大小不同），跳过 {src_file}")
-                return False
             try:
-                shutil.copy2(src_file, renamed_dest)
+                link_or_copy_file(src_file, renamed_dest, src_data, src_size)
                 if os.path.exists(renamed_dest):
                     logging.debug(f"目标文件 {renamed_dest} 校验成功！")
                 else:
@@ -312,7 +623,7 @@ def copy_file_to_album(src_file, album_folder):
                 return False
     else:
         try:
-            shutil.copy2(src_file, dest_file)
+            link_or_copy_file(src_file, dest_file, src_data, src_size)
             if os.path.exists(dest_file):
                 logging.debug(f"目标文件 {dest_file} 校验成功！")
             else:
@@ -322,62 +633,79 @@ def copy_file_to_album(src_file, album_folder):
             logging.error(f"复制 {src_file} 到 {dest_file} 失败: {e}")
             return False
 
-def process_album_image(image_name, album_set, target_root, allowed_albums=None):
+def process_album_image(image_name, album_set, target_root, allowed_albums=None, trust_mtime=False):
     """
     根据传入的 image_name 和该照片所属的 album_set，
     将照片复制到各个相册文件夹中。如果参数 allowed_albums 指定了要复制的相册，则只复制这些相册。
     同时检测是否存在与该图片同名的 .MOV 文件（即 Live Photo）。
     如果发现主图或 Live Photo 已重命名（带有 "_1" 后缀），则直接跳过该照片。
     只有在至少复制成功到一个相册后，才删除目标根目录中的主图和 Live Photo文件。
+    trust_mtime 参见 copy_file_to_album。
     """
-    orig_path = os.path.join(target_root, image_name)
+    # 目标根目录前缀（以路径分隔符结尾）只计算一次，之后直接拼接文件名
+    root_prefix = os.path.join(target_root, "")
+    orig_path = f"{root_prefix}{image_name}"
     base, ext = os.path.splitext(image_name)
     renamed_name = f"{base}_1{ext}"
-    renamed_path = os.path.join(target_root, renamed_name)
+    renamed_path = f"{root_prefix}{renamed_name}"
 
     # 如果目标中存在已重命名的主图，则跳过
-    if os.path.exists(renamed_path):
+    if stat_or_none(renamed_path) is not None:
         logging.warning(f"文件 {image_name} 已经被重命名为 {renamed_name}，跳过 album 复制。")
         return
-    if not os.path.exists(orig_path):
+    file_stat = stat_or_none(orig_path)
+    if file_stat is None:
         logging.warning(f"目标根目录中未找到照片 {image_name}，跳过。")
         return
     file_to_copy = orig_path
 
     # 检查对应的 Live Photo (.MOV 文件)
-    live_photo_orig = os.path.join(target_root, base + ".MOV")
-    live_photo_renamed = os.path.join(target_root, base + "_1.MOV")
-    if os.path.exists(live_photo_renamed):
+    live_photo_orig = f"{root_prefix}{base}.MOV"
+    live_photo_renamed = f"{root_prefix}{base}_1.MOV"
+    if stat_or_none(live_photo_renamed) is not None:
         logging.warning(f"Live photo for {image_name} 已重命名为 {base}_1.MOV，跳过 album 复制。")
         return
-    live_photo_to_copy = live_photo_orig if os.path.exists(live_photo_orig) else None
+    live_photo_stat = stat_or_none(live_photo_orig)
+    live_photo_to_copy = live_photo_orig if live_photo_stat is not None else None
 
     copied_to_any_album = False  # 记录是否至少复制到一个相册
 
-    # 遍历 album_set，根据 allowed_albums 过滤
-    for album in album_set:
-        if allowed_albums is not None and album not in allowed_albums:
-            logging.debug(f"跳过不在允许列表中的相册 {album}")
-            continue
-        album_folder = os.path.join(target_root, album)
-        if not os.path.exists(album_folder):
-            try:
-                os.makedirs(album_folder, exist_ok=True)
-                logging.info(f"创建相册文件夹: {album_folder}")
-            except Exception as e:
-                logging.error(f"创建相册文件夹失败 {album_folder}: {e}")
+    # 源文件只读取一次，映射到内存后写入各个相册；可以使用硬链接时无需读取源文件
+    image_data = None
+    live_photo_data = None
+    if not supports_hard_links(target_root):
+        image_data = map_file_readonly(file_to_copy)
+        live_photo_data = map_file_readonly(live_photo_to_copy) if live_photo_to_copy else None
+    try:
+        # 遍历 album_set，根据 allowed_albums 过滤
+        for album in album_set:
+            if allowed_albums is not None and album not in allowed_albums:
+                logging.debug(f"跳过不在允许列表中的相册 {album}")
                 continue
-        success_image = copy_file_to_album(file_to_copy, album_folder)
-        if success_image:
-            copied_to_any_album = True
-        else:
-            logging.warning(f"复制 {file_to_copy} 到相册 {album_folder} 失败或被跳过。")
-        if live_photo_to_copy:
-            success_live = copy_file_to_album(live_photo_to_copy, album_folder)
-            if success_live:
+            album_folder = f"{root_prefix}{album}"
+            if not os.path.exists(album_folder):
+                try:
+                    os.makedirs(album_folder, exist_ok=True)
+                    logging.info(f"创建相册文件夹: {album_folder}")
+                except Exception as e:
+                    logging.error(f"创建相册文件夹失败 {album_folder}: {e}")
+                    continue
+            success_image = copy_file_to_album(file_to_copy, album_folder, image_data, file_stat, trust_mtime)
+            if success_image:
                 copied_to_any_album = True
             else:
-                logging.warning(f"复制 live photo {live_photo_to_copy} 到相册 {album_folder} 失败或被跳过。")
+                logging.warning(f"复制 {file_to_copy} 到相册 {album_folder} 失败或被跳过。")
+            if live_photo_to_copy:
+                success_live = copy_file_to_album(live_photo_to_copy, album_folder, live_photo_data, live_photo_stat, trust_mtime)
+                if success_live:
+                    copied_to_any_album = True
+                else:
+                    logging.warning(f"复制 live photo {live_photo_to_copy} 到相册 {album_folder} 失败或被跳过。")
+    finally:
+        # 删除原文件前必须先释放内存映射
+        for data in (image_data, live_photo_data):
+            if data is not None:
+                data.close()
     # 只有在至少复制到一个相册后，才删除原文件
     if copied_to_any_album:
         try:
@@ -392,7 +720,18 @@ def process_album_image(image_name, album_set, target_root, allowed_albums=None)
             except Exception as e:
                 logging.error(f"删除 live photo 文件 {live_photo_to_copy} 失败: {e}")
 
+def process_album_group(images, target_root, allowed_albums=None, trust_mtime=False):
+    """
+    依次处理同一文件名组（见 file_group_key）的照片，images 为 (image_name, album_set) 列表。
+    同组照片可能共用同一个 Live Photo (.MOV) 文件，且 process_album_image 会检查
+    {basename}_1 文件来决定是否跳过，因此放在同一线程中顺序处理。
+    """
+    for image_name, album_set in images:
+        process_album_image(image_name, album_set, target_root, allowed_albums, trust_mtime)
+
 def main():
+    global hash_cache
+
     # 请根据实际情况修改以下路径
     source_root = r"D:\Download\数据和隐私"
     target_root = r"D:\Download\Photos"
@@ -406,24 +745,75 @@ def main():
     # 若不限制复制所有相册，则设置为 None
     allowed_albums = None  # 例如：allowed_albums = {"Hidden"}
 
-    os.makedirs(target_root, exist_ok=True)
+    # 文件哈希缓存数据库路径，重复运行时可跳过未改动文件的哈希计算
+    hash_cache_path = "hashcache.db"
 
-    logging.info("========== 阶段1：将所有照片从各部分复制到目标根目录 ==========")
-    for part in range(1, total_parts + 1):
-        logging.info(f"处理第 {part} 部分")
-        process_part_phase1(part, source_root, target_root, total_parts)
-    logging.info("阶段1完成。")
+    # 阶段2中相册已有同名文件时，若大小、修改时间与文件开头 64 KiB 均相同则视为相同文件，
+    # 跳过完整哈希比较。注意：修改时间来自 importDate，只精确到分钟，开头相同而后面不同的文件
+    # 会被误判为相同，根目录中的该文件随后会被删除而不会进入相册，请仅在确认无此类文件时开启
+    trust_mtime = False
 
-    logging.info("========== 阶段2：根据 Albums 信息整理相册 ==========")
-    albums_mapping = build_global_album_mapping(source_root, total_parts)
-    for image_name, album_set in albums_mapping.items():
-        process_album_image(image_name, album_set, target_root, allowed_albums)
-    logging.info("阶段2完成。")
+    # 阶段1同时处理的部分数量 / 文件名组数量（线程数）
+    phase1_workers = 8
+    # 阶段2同时处理的照片数量（线程数）
+    phase2_workers = min(8, (os.cpu_count() or 1) * 2)
+
+    os.makedirs(target_root, exist_ok=True)
+    hash_cache = FileHashCache(hash_cache_path)
+    try:
+        logging.info("========== 阶段1：将所有照片从各部分复制到目标根目录 ==========")
+        target_index = build_target_index(target_root)
+        with ThreadPoolExecutor(max_workers=phase1_workers) as executor:
+            # 并行扫描各部分，map 按部分编号顺序返回结果
+            part_files = executor.map(
+                lambda part: scan_part_phase1(part, source_root, total_parts),
+                range(1, total_parts + 1)
+            )
+            # 按文件名组归类，组内保持部分编号和目录枚举顺序；各组并行复制，组内顺序处理
+            file_groups = {}
+            for files in part_files:
+                for src_file, file_name, file_size in files:
+                    file_groups.setdefault(file_group_key(file_name), []).append((src_file, file_size))
+            futures = [
+                executor.submit(copy_file_group_phase1, files, target_root, target_index)
+                for files in file_groups.values()
+            ]
+            for future in as_completed(futures):
+                future.result()
+        logging.info("阶段1完成。")
+
+        logging.info("========== 阶段2：根据 Albums 信息整理相册 ==========")
+        albums_mapping = build_global_album_mapping(source_root, total_parts)
+        # 按文件名组（见 file_group_key）分组，主图、Live Photo 及其 "_1" 重命名文件
+        # 只由一个线程按原顺序检查、复制和删除
+        image_groups = {}
+        for image_name, album_set in albums_mapping.items():
+            image_groups.setdefault(file_group_key(image_name), []).append((image_name, album_set))
+        with ThreadPoolExecutor(max_workers=phase2_workers) as executor:
+            futures = [
+                executor.submit(process_album_group, images, target_root, allowed_albums, trust_mtime)
+                for images in image_groups.values()
+            ]
+            for future in as_completed(futures):
+                future.result()
+        logging.info("阶段2完成。")
+    finally:
+        hash_cache.close()
+        hash_cache = None
 
 if __name__ == "__main__":
+    # 日志先写入队列，由独立线程格式化并输出到控制台，避免控制台输出拖慢复制
+    log_queue = queue.Queue(-1)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, console_handler)
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[logging.StreamHandler()]
+        format="%(message)s",
+        handlers=[logging.handlers.QueueHandler(log_queue)]
     )
-    main()
+    log_listener.start()
+    try:
+        main()
+    finally:
+        log_listener.stop()